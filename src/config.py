@@ -15,14 +15,75 @@ OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
 YOLO_MODEL_PATH = os.path.join(BASE_DIR, "../models/Baseline_YOLOv8Small_Filtered.pt")
 
 BLIP_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+BLIP_PRECISION = "auto"  # "auto", "fp32", "fp16", "bf16" or "int8" (CPU dynamic quantization)
+BLIP_BATCH_SIZE = 8
+BLIP_MAX_NEW_TOKENS = 30  # Captions are short; cap decoding length
 LLAMA_MODEL_DEFAULT = "llama3.2:3b"
 LLAMA_VISION_MODEL = "llama3.2-vision"
 
+# === Triage Summary Prompt ===
+# Local tokenizer for prompt budgeting (loaded with local_files_only; see README)
+LLM_TOKENIZER_NAME = os.path.join(BASE_DIR, "../models/llm_tokenizer")
+LLM_CHARS_PER_TOKEN = 3  # Conservative estimate when the tokenizer cannot be loaded
+LLM_KEEP_ALIVE = "30m"  # Keep the model (and its prompt cache) loaded between requests
+SUMMARY_PROMPT_TOKEN_BUDGET = 384  # Tokens for the per-case JSON, after the fixed system prefix
+SUMMARY_MAX_AMENITY_TYPES = 10
+SUMMARY_TRAFFIC_TAGS = [
+    "highway",
+    "maxspeed",
+    "lanes",
+    "surface",
+    "oneway",
+    "lit",
+    "lanes:bus",
+    "parking:both",
+]
+
+# === Vision Insight Routing ===
+VISION_BACKENDS = ["ollama", "blip", "yolo"]  # Preference order, richest first
+VISION_BACKEND_EXPECTED_LATENCY_S = {  # Initial estimates, refined from observed latencies
+    "ollama": 15.0,
+    "blip": 2.0,
+    "yolo": 0.5,
+}
+VISION_LATENCY_BUDGET_S = 20.0
+VISION_LATENCY_EWMA_ALPHA = 0.3
+VISION_PROBE_INTERVAL_S = 30.0  # Background canary for backends the router keeps skipping
+VISION_MAX_WORKERS = 4  # Per backend, so a hung tier cannot starve the others
+VISION_OLLAMA_TIMEOUT_S = VISION_LATENCY_BUDGET_S  # Client timeout; frees the worker of an abandoned call
+
 # === Radii & Thresholds ===
 AMENITY_RADIUS = 500  # Radius for querying amenities (meters)
 FACILITY_THRESHOLD_M = 200  # Critical distance in meters for facility risk
 TRAFFIC_RADIUS = 300  # Radius for querying traffic data (meters)
 
+# === Road Attribute Tile Cache ===
+ROAD_TILE_CACHE_DIR = os.path.join(BASE_DIR, "../cache/road_tiles")
+ROAD_TILE_ZOOM = 16  # Slippy-map zoom of cached tiles (~600 m wide)
+ROAD_TILE_BUCKET_BITS = 3  # Each tile is indexed as an 8x8 grid of segment buckets
+ROAD_TILE_MEMORY_CACHE_SIZE = 256  # Memory-mapped tiles kept open per process
+
+# === Critical Facilities ===
+CRITICAL_FACILITY_TYPES = [
+    ("hospital", "🚑"),
+    ("school", "🏫"),
+    ("police", "👮"),
+    ("subway_entrance", "🚇"),
+]
+
+# === Batch Import ===
+NOMINATIM_MIN_INTERVAL_S = 1.0  # Nominatim usage policy: at most 1 request/second
+OVERPASS_MIN_INTERVAL_S = 1.0  # Keeps large backlogs under the public Overpass rate limit
+BATCH_GEOCODE_RETRIES = 3
+BATCH_OVERPASS_RETRIES = 3
+BATCH_CHUNK_SIZE = 100  # Reports geocoded and written per chunk, so output streams early
+BATCH_WORKERS = 4  # Threads processing cells; API calls still share the rate limiters
+BATCH_MAX_PENDING_CELLS = 64  # Cells queued for the workers before geocoding waits
+BATCH_CELL_CACHE_SIZE = 512  # Cell amenity lookups kept for reuse by later chunks
+BATCH_LOCATION_DECIMALS = 4  # ~11 m: reports closer than this share a location
+BATCH_CELL_DECIMALS = 3  # ~110 m: reports in the same cell share Overpass lookups
+BATCH_GENERATE_SUMMARY = False  # LLM summary per report (slow for large backlogs)
+
 # === Severity Colors ===
 SEVERITY_COLORS = {
     "Low": "#5cb85c",
@@ -36,6 +97,14 @@ FOLIUM_DEFAULT_ZOOM_START = 16
 FOLIUM_MAP_WIDTH = 700
 FOLIUM_MAP_HEIGHT = 450
 
+# === Map Rendering ===
+MAP_RENDER_MODE = "html"  # "html" (cached, GeoJSON layer), "png" (static thumbnail) or "interactive"
+MAP_CACHE_DECIMALS = 4  # Locations rounded to ~11 m share a cached map
+MAP_CACHE_MAX_ENTRIES = 256
+MAP_TILE_URL = "https://a.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png"  # Matches FOLIUM_TILE_TYPE
+MAP_TILE_CACHE_DIR = os.path.join(BASE_DIR, "../cache/map_tiles")
+MAP_TILES_OFFLINE = False  # Only use already cached tiles for PNG thumbnails
+
 # === Folium Marker & Circle Defaults ===
 POTHOLE_MARKER_COLOR = "red"
 POTHOLE_MARKER_ICON = "exclamation-triangle"
@@ -4,10 +4,11 @@ from PIL import Image
 import uuid
 import tempfile
 import folium
+import streamlit.components.v1 as components
 from streamlit_folium import st_folium
 
 # Import service modules and configuration
-from services import detection, captioning, llm, geo
+from services import detection, captioning, llm, geo, batch, vision, static_map
 import config
 
 # ------------------------------------------------------------------
@@ -53,9 +54,27 @@ def display_tag(label, value, icon):
 
 
 # ------------------------------------------------------------
-# Presentation-only helper: Render a folium mini-map.
+# Presentation-only helpers: Render a folium mini-map.
 # (This is pure UI code, so it's kept here.)
-def render_mini_map(lat, lon, facility_flags, radius=config.AMENITY_RADIUS):
+def _facility_points(facility_flags):
+    """
+    Flattens facility query results into a sorted tuple of (lat, lon, label),
+    which doubles as the cache key for the rendered map.
+    """
+    points = set()
+    for facility in facility_flags:
+        tag = facility.get("tag", "unknown")
+        emoji = facility.get("emoji", "🏷️")
+        elements = facility.get("results", {}).get("elements", [])
+        for el in elements:
+            f_lat, f_lon = geo.element_coords(el)
+            name = el.get("tags", {}).get("name", "Unnamed")
+            if f_lat and f_lon:
+                points.add((round(f_lat, 6), round(f_lon, 6), f"{emoji} {tag.title()}: {name}"))
+    return tuple(sorted(points))
+
+
+def _build_folium_map(lat, lon, facility_points, radius):
     m = folium.Map(
         location=[lat, lon],
         zoom_start=config.FOLIUM_DEFAULT_ZOOM_START,
@@ -90,32 +109,158 @@ def render_mini_map(lat, lon, facility_flags, radius=config.AMENITY_RADIUS):
         fill_opacity=config.RADIUS_CIRCLE_FILL_OPACITY,
     ).add_to(m)
 
-    # Facility markers from query results
-    for facility in facility_flags:
-        tag = facility.get("tag", "unknown")
-        emoji = facility.get("emoji", "🏷️")
-        elements = facility.get("results", {}).get("elements", [])
-        for el in elements:
-            f_lat = el.get("lat") or el.get("center", {}).get("lat")
-            f_lon = el.get("lon") or el.get("center", {}).get("lon")
-            name = el.get("tags", {}).get("name", "Unnamed")
-            if f_lat and f_lon:
-                folium.Marker(
-                    [f_lat, f_lon],
-                    tooltip=f"{emoji} {tag.title()}: {name}",
-                    icon=folium.Icon(
-                        color=config.FACILITY_MARKER_COLOR,
-                        icon=config.FACILITY_MARKER_ICON,
-                        prefix="fa",
-                    ),
-                ).add_to(m)
+    # All facilities as a single GeoJSON layer instead of one Marker each
+    if facility_points:
+        folium.GeoJson(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "type": "Feature",
+                        "geometry": {"type": "Point", "coordinates": [f_lon, f_lat]},
+                        "properties": {"label": label},
+                    }
+                    for f_lat, f_lon, label in facility_points
+                ],
+            },
+            marker=folium.CircleMarker(
+                radius=6,
+                color="white",
+                weight=1,
+                fill=True,
+                fill_color=config.FACILITY_MARKER_COLOR,
+                fill_opacity=0.9,
+            ),
+            tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False),
+        ).add_to(m)
+
+    return m
+
+
+@st.cache_data(max_entries=config.MAP_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_map_html(lat, lon, facility_points, radius):
+    return _build_folium_map(lat, lon, facility_points, radius).get_root().render()
+
+
+class _IncompleteThumbnail(Exception):
+    """Raised from the cached renderer so thumbnails with missing tiles are not cached."""
 
+    def __init__(self, png, missing):
+        super().__init__(f"{missing} base-map tiles unavailable")
+        self.png = png
+        self.missing = missing
+
+
+@st.cache_data(max_entries=config.MAP_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_map_png(lat, lon, facility_points, radius, offline):
+    png, missing = static_map.render_thumbnail(
+        lat, lon, facility_points, radius=radius, offline=offline
+    )
+    if missing:
+        raise _IncompleteThumbnail(png, missing)
+    return png
+
+
+def render_mini_map(
+    lat, lon, facility_flags, radius=config.AMENITY_RADIUS, mode=config.MAP_RENDER_MODE
+):
+    facility_points = _facility_points(facility_flags)
     st.markdown("### 🗺️ Facility Map")
-    st_folium(m, width=config.FOLIUM_MAP_WIDTH, height=config.FOLIUM_MAP_HEIGHT)
+
+    if mode == "interactive":
+        m = _build_folium_map(lat, lon, facility_points, radius)
+        st_folium(m, width=config.FOLIUM_MAP_WIDTH, height=config.FOLIUM_MAP_HEIGHT)
+        return
+
+    # Cached modes: nearby reruns with the same facilities reuse the rendered map.
+    lat_key = round(lat, config.MAP_CACHE_DECIMALS)
+    lon_key = round(lon, config.MAP_CACHE_DECIMALS)
+    if mode == "png":
+        try:
+            png = _cached_map_png(
+                lat_key, lon_key, facility_points, radius, config.MAP_TILES_OFFLINE
+            )
+        except _IncompleteThumbnail as e:
+            png = e.png
+            st.caption(f"⚠️ {e} — thumbnail not cached, will retry on next render.")
+        st.image(png, width=config.FOLIUM_MAP_WIDTH)
+    else:
+        html = _cached_map_html(lat_key, lon_key, facility_points, radius)
+        components.html(
+            html, width=config.FOLIUM_MAP_WIDTH, height=config.FOLIUM_MAP_HEIGHT
+        )
+
+# ------------------------------------------------------------
+# Bulk import: CSV/GeoJSON backlog of citizen reports (services/batch.py)
+def render_batch_import():
+    st.markdown("### 📦 Bulk Report Import")
+    st.caption(
+        "CSV columns: `id, address, lat, lon, image_path` — or GeoJSON Point features "
+        "with `address`/`image_path` properties."
+    )
+    reports_file = st.file_uploader(
+        "📤 Drop or select a report file", type=["csv", "geojson", "json"]
+    )
+    summarize = st.checkbox(
+        "🧠 Generate LLM summary per report", value=config.BATCH_GENERATE_SUMMARY
+    )
+    if not reports_file or not st.button("🚀 Run bulk triage"):
+        return
+
+    try:
+        reports = batch.load_reports(reports_file, filename=reports_file.name)
+    except ValueError as e:
+        st.error(f"Could not read report file: {e}")
+        return
+    st.info(f"Loaded `{len(reports)}` reports.")
+
+    progress_bar = st.progress(0.0)
+
+    def on_progress(done, total):
+        progress_bar.progress(done / total if total else 1.0, text=f"{done}/{total}")
+
+    # Spooled to an anonymous temp file that is deleted on close.
+    with tempfile.TemporaryFile("w+", suffix=".jsonl", encoding="utf-8") as out:
+        with st.spinner("Triaging reports..."):
+            stats = batch.run_batch(
+                reports, out, summarize=summarize, progress=on_progress
+            )
+        out.seek(0)
+        results = out.read()
+
+    st.success("Bulk triage finished.")
+    st.json(stats)
+    st.download_button(
+        "💾 Download results (JSONL)",
+        data=results,
+        file_name="triage_results.jsonl",
+        mime="application/jsonl",
+    )
+
 
 # ------------------------------------------------------------
 # Main application code
 
+mode = st.sidebar.radio("Mode", ["🖼️ Single image", "📦 Bulk import"])
+if mode == "📦 Bulk import":
+    render_batch_import()
+    st.stop()
+
+vision.warm_up(["blip"])  # YOLO is registered from the detection step
+vision_budget_s = st.sidebar.slider(
+    "⏱️ Vision insight budget (s)",
+    min_value=1.0,
+    max_value=60.0,
+    value=config.VISION_LATENCY_BUDGET_S,
+    step=1.0,
+)
+map_modes = ["html", "png", "interactive"]
+map_mode = st.sidebar.selectbox(
+    "🗺️ Map rendering",
+    map_modes,
+    index=map_modes.index(config.MAP_RENDER_MODE),
+)
+
 # File Uploader
 uploaded_file = st.file_uploader(
     "📤 Drop or select a road image", type=["jpg", "jpeg", "png"]
@@ -133,6 +278,7 @@ if uploaded_file:
     # Step 1: Detection using YOLO
     with st.spinner("Step 1: Detecting potholes..."):
         model = detection.load_model()
+        vision.register_model("yolo", model)
         annotated_img, pothole_areas, avg_area, severity = detection.detect_potholes(
             model, image
         )
@@ -198,18 +344,15 @@ if uploaded_file:
         with st.spinner("Step 2: Seaching for amenities in the vicinity..."):
 
             all_amenities = geo.query_all_amenities(lat, lon)
-            organized_amenities = geo.organize_amenities_by_type(all_amenities)
+            organized_amenities = (
+                geo.organize_amenities_by_type(all_amenities)
+                if isinstance(all_amenities, list)
+                else {}
+            )
 
             # 🏥 Facilities
             facility_flags = geo.query_nearby_amenities(
-                lat,
-                lon,
-                types=[
-                    ("hospital", "🚑"),
-                    ("school", "🏫"),
-                    ("police", "👮"),
-                    ("subway_entrance", "🚇"),
-                ],
+                lat, lon, types=config.CRITICAL_FACILITY_TYPES
             )
 
         # 🏥 Facility Overview
@@ -311,9 +454,15 @@ if uploaded_file:
                 image.save(tmp.name)
                 image_path = tmp.name
 
-            llm_insight = llm.generate_llm_insight(image_path)
+            llm_insight = vision.generate_insight(
+                image, image_path, budget_s=vision_budget_s
+            )
 
-        with st.expander("📤 Step 3: LLaMA Triage Insight"):
+        with st.expander("📤 Step 3: Vision Insight"):
+            st.markdown(
+                f"**⚙️ Backend:** `{llm_insight.get('backend')}` — "
+                f"**⏱️ Latency:** `{llm_insight.get('latency_s', '—')} s`"
+            )
             st.json(llm_insight)
 
         with st.spinner("🧠 Step 5: Generating final triage summary..."):
@@ -350,4 +499,4 @@ if uploaded_file:
 
         with st.spinner("Step 5: Rendering mini map..."):
             # Step 5: Render facility map.
-            render_mini_map(lat, lon, facility_flags)
+            render_mini_map(lat, lon, facility_flags, mode=map_mode)
@@ -0,0 +1,535 @@
+# services/batch.py
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+import config
+from services import detection, geo, llm, road_tiles
+
+ADDRESS_NOT_FOUND = "Endereço não encontrado"
+
+
+class RateLimiter:
+    """
+    Spaces calls at least `min_interval` seconds apart, across threads.
+    """
+
+    def __init__(self, min_interval=config.NOMINATIM_MIN_INTERVAL_S):
+        self.min_interval = min_interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def backoff(self, seconds):
+        """
+        Holds every caller back for `seconds`, e.g. after a failed or
+        rate-limited request.
+        """
+        with self._lock:
+            self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+def _parse_float(value):
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _normalize_address(address):
+    return " ".join(address.lower().split()) if address else ""
+
+
+def _read_text(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8-sig") as f:
+            return f.read()
+    data = source.read()
+    return data.decode("utf-8-sig") if isinstance(data, bytes) else data
+
+
+def load_reports(source, filename=None):
+    """
+    Loads citizen reports from a CSV or GeoJSON file (path or file-like object).
+
+    CSV columns: id, address, lat, lon, image_path (address or lat/lon required).
+    GeoJSON: a FeatureCollection (or single Feature) of Points with
+    id/address/image_path in properties. Raises ValueError for other shapes.
+
+    Returns:
+        List of report dicts with keys id, address, lat, lon, image_path.
+    """
+    name = (filename or str(source)).lower()
+    text = _read_text(source)
+    reports = []
+
+    if name.endswith((".geojson", ".json")):
+        data = json.loads(text)
+        kind = data.get("type") if isinstance(data, dict) else None
+        if kind == "FeatureCollection":
+            features = data.get("features") or []
+        elif kind == "Feature":
+            features = [data]
+        else:
+            raise ValueError(
+                "Unsupported GeoJSON: expected a FeatureCollection or a Feature object"
+            )
+        for index, feature in enumerate(features):
+            props = feature.get("properties") or {}
+            geometry = feature.get("geometry") or {}
+            lat = lon = None
+            if geometry.get("type") == "Point":
+                lon, lat = geometry.get("coordinates", [None, None])[:2]
+            reports.append({
+                "id": str(feature.get("id") or props.get("id") or index),
+                "address": props.get("address"),
+                "lat": _parse_float(lat),
+                "lon": _parse_float(lon),
+                "image_path": props.get("image_path"),
+            })
+    else:
+        for index, row in enumerate(csv.DictReader(io.StringIO(text))):
+            reports.append({
+                "id": row.get("id") or str(index),
+                "address": row.get("address"),
+                "lat": _parse_float(row.get("lat")),
+                "lon": _parse_float(row.get("lon")),
+                "image_path": row.get("image_path"),
+            })
+    return reports
+
+
+def _place(result):
+    """
+    Keeps only the reverse-geocoding fields the triage uses.
+    """
+    place = {"display_name": result.get("display_name"), "address": result.get("address", {})}
+    if result.get("error"):
+        place["error"] = result["error"]
+    return place
+
+
+def geocode_address(address, limiter):
+    """
+    Forward-geocodes an address with address details in a single Nominatim
+    call, retrying request errors with exponential backoff.
+
+    Returns:
+        lat, lon, place ({"display_name", "address"}) and an error message
+        (None on success).
+    """
+    error = None
+    for attempt in range(config.BATCH_GEOCODE_RETRIES):
+        limiter.wait()
+        try:
+            result = geo.search_address(address)
+        except Exception as e:
+            error = f"Erro ao buscar endereço: {str(e)}"
+            limiter.backoff(2 ** attempt)
+            continue
+        if not result:
+            return None, None, None, ADDRESS_NOT_FOUND
+        return float(result["lat"]), float(result["lon"]), _place(result), None
+    return None, None, None, error
+
+
+def _cell_key(lat, lon):
+    return round(lat, config.BATCH_CELL_DECIMALS), round(lon, config.BATCH_CELL_DECIMALS)
+
+
+def _cell_padding_m(cell_lat, cell_lon):
+    half_step = 0.5 * 10 ** -config.BATCH_CELL_DECIMALS
+    return geo.haversine_m(cell_lat, cell_lon, cell_lat + half_step, cell_lon + half_step)
+
+
+def _result_error(result):
+    return result.get("error") if isinstance(result, dict) else None
+
+
+def _facility_error(items):
+    for item in items:
+        results = item.get("results", {})
+        if results.get("error") or results.get("remark"):
+            return results.get("error") or results.get("remark")
+    return None
+
+
+def _overpass_with_retry(query, error_of, limiter):
+    """
+    Runs an Overpass query under the rate limiter, retrying failures
+    (HTTP errors, 429s, Overpass runtime remarks) with exponential backoff.
+    The backoff is applied to the limiter, so it holds back every worker.
+    """
+    for attempt in range(config.BATCH_OVERPASS_RETRIES):
+        limiter.wait()
+        result = query()
+        if not error_of(result):
+            break
+        limiter.backoff(2 ** attempt)
+    return result
+
+
+def fetch_cell_context(cell_lat, cell_lon, limiter=None):
+    """
+    Runs the amenity Overpass lookups once for a grid cell.
+
+    Each radius is padded by the cell half-diagonal so that the results cover
+    every point in the cell; points filter them back to their own radius.
+    Lookups that still fail after retries are listed under "errors".
+    """
+    limiter = limiter or RateLimiter(config.OVERPASS_MIN_INTERVAL_S)
+    padding = _cell_padding_m(cell_lat, cell_lon)
+    amenity_radius = config.AMENITY_RADIUS + padding
+    errors = {}
+
+    amenities = _overpass_with_retry(
+        lambda: geo.query_all_amenities(cell_lat, cell_lon, radius=amenity_radius),
+        _result_error,
+        limiter,
+    )
+    if _result_error(amenities):
+        errors["amenities"] = _result_error(amenities)
+
+    facilities = []
+    for facility_type in config.CRITICAL_FACILITY_TYPES:
+        items = _overpass_with_retry(
+            lambda: geo.query_nearby_amenities(
+                cell_lat, cell_lon, [facility_type], radius=amenity_radius
+            ),
+            _facility_error,
+            limiter,
+        )
+        if _facility_error(items):
+            errors[facility_type[0]] = _facility_error(items)
+        facilities.extend(items)
+
+    return {"amenities": amenities, "facilities": facilities, "errors": errors}
+
+
+_road_tile_lock = threading.Lock()
+
+
+def _build_road_tile(x, y):
+    try:
+        road_tiles.build_tile(x, y)
+    except Exception as e:
+        return {"error": str(e)}
+    return {}
+
+
+def ensure_road_tiles(lat, lon, limiter):
+    """
+    Builds the road tiles a traffic lookup at (lat, lon) needs and that are
+    not cached yet, under the Overpass rate limiter and with retries.
+
+    Returns:
+        An error message if a tile could not be built, else None.
+    """
+    missing = [t for t in road_tiles.tiles_around(lat, lon) if not road_tiles.is_cached(*t)]
+    if not missing:
+        return None
+    # One builder at a time, so workers never download the same tile twice.
+    with _road_tile_lock:
+        for x, y in missing:
+            if road_tiles.is_cached(x, y):
+                continue
+            result = _overpass_with_retry(
+                lambda: _build_road_tile(x, y), _result_error, limiter
+            )
+            if _result_error(result):
+                return _result_error(result)
+    return None
+
+
+def _within(elements, lat, lon, radius):
+    nearby = []
+    for el in elements:
+        e_lat, e_lon = geo.element_coords(el)
+        if e_lat is not None and e_lon is not None and geo.haversine_m(lat, lon, e_lat, e_lon) <= radius:
+            nearby.append(el)
+    return nearby
+
+
+def point_context(cell_context, lat, lon, street_name=None, limiter=None):
+    """
+    Narrows a shared cell context down to a single point.
+
+    Returns:
+        all_amenities, facility_flags, traffic_data in the same shapes as the
+        single-report functions in services/geo.py. Traffic data comes from
+        the road tile cache, which nearby points share on its own; missing
+        tiles are built under `limiter` first.
+    """
+    all_amenities = cell_context["amenities"]
+    if isinstance(all_amenities, list):
+        all_amenities = _within(all_amenities, lat, lon, config.AMENITY_RADIUS)
+
+    facility_flags = []
+    for item in cell_context["facilities"]:
+        results = item.get("results", {})
+        if "elements" in results:
+            results = {**results, "elements": _within(results["elements"], lat, lon, config.AMENITY_RADIUS)}
+        facility_flags.append({**item, "results": results})
+
+    tile_error = ensure_road_tiles(
+        lat, lon, limiter or RateLimiter(config.OVERPASS_MIN_INTERVAL_S)
+    )
+    if tile_error:
+        traffic_data = {"error": tile_error}
+    else:
+        traffic_data = geo.query_traffic_data(lat, lon, street_name=street_name)
+
+    return all_amenities, facility_flags, traffic_data
+
+
+def _critical_facilities(facility_flags, lat, lon):
+    facilities = []
+    for item in facility_flags:
+        for el in item.get("results", {}).get("elements", []):
+            f_lat, f_lon = geo.element_coords(el)
+            if f_lat is None or f_lon is None:
+                continue
+            distance = geo.haversine_m(lat, lon, f_lat, f_lon)
+            facilities.append({
+                "type": item["tag"],
+                "name": el.get("tags", {}).get("name", "Unnamed Facility"),
+                "distance_m": round(distance, 1),
+                "critical": distance < config.FACILITY_THRESHOLD_M,
+            })
+    return sorted(facilities, key=lambda f: f["distance_m"])
+
+
+def _detect(model, image_path, cache, lock):
+    # The YOLO model is not thread-safe; workers take turns on it.
+    with lock:
+        if image_path not in cache:
+            try:
+                image = Image.open(image_path).convert("RGB")
+                _, pothole_areas, avg_area, severity = detection.detect_potholes(model, image)
+                cache[image_path] = {
+                    "potholes_detected": len(pothole_areas),
+                    "average_area": float(avg_area),
+                    "severity": severity,
+                }
+            except Exception as e:
+                cache[image_path] = {"error": f"Detection failed: {str(e)}"}
+        return cache[image_path]
+
+
+def _triage_record(
+    report, lat, lon, place, cell_context, model, detections, detect_lock, overpass, summarize
+):
+    """
+    Enriches one located report. Lookups that failed are reported under
+    "errors" and their fields set to None, so a failure never reads as
+    "nothing nearby".
+    """
+    address = place.get("address", {})
+    all_amenities, facility_flags, traffic_data = point_context(
+        cell_context, lat, lon, street_name=address.get("road"), limiter=overpass
+    )
+    errors = dict(cell_context["errors"])
+    if place.get("error"):
+        errors["reverse_geocode"] = place["error"]
+    if traffic_data.get("error") and traffic_data["error"] != road_tiles.NO_ROAD_FOUND:
+        errors["traffic"] = traffic_data["error"]
+
+    organized_amenities = (
+        geo.organize_amenities_by_type(all_amenities)
+        if isinstance(all_amenities, list)
+        else {}
+    )
+    detected = (
+        _detect(model, report["image_path"], detections, detect_lock)
+        if report["image_path"]
+        else {"error": "No image provided"}
+    )
+
+    record = {
+        "id": report["id"],
+        "address": report["address"],
+        "lat": lat,
+        "lon": lon,
+        "display_name": place.get("display_name"),
+        "city": address.get("city"),
+        "road": address.get("road"),
+        "image_path": report["image_path"],
+        "detection": detected,
+        "traffic": None if "traffic" in errors else traffic_data.get("tags", {}),
+        "amenity_counts": (
+            None
+            if "amenities" in errors
+            else {k: len(v) for k, v in organized_amenities.items()}
+        ),
+        "critical_facilities": (
+            None
+            if any(tag in errors for tag, _ in config.CRITICAL_FACILITY_TYPES)
+            else _critical_facilities(facility_flags, lat, lon)
+        ),
+    }
+    if errors:
+        record["errors"] = errors
+    if summarize:
+        record["summary"] = llm.generate_triage_summary(
+            geo_info=place,
+            lat=lat,
+            lon=lon,
+            severity=detected.get("severity"),
+            traffic_data=traffic_data,
+            facility_flags=facility_flags,
+            organized_amenities=organized_amenities,
+        )
+    return record
+
+
+def run_batch(reports, output, summarize=config.BATCH_GENERATE_SUMMARY, progress=None):
+    """
+    Triages a backlog of reports and streams one JSON line per report to `output`.
+
+    Reports are geocoded in chunks of BATCH_CHUNK_SIZE (one Nominatim call
+    per unique address, address details included) and grouped into cells
+    so that nearby reports share amenity lookups. Cells are then processed
+    by BATCH_WORKERS threads (reverse geocoding, Overpass, YOLO, optional
+    summary) while the next chunk is geocoded. Nominatim and Overpass calls
+    go through shared rate limiters and are retried with backoff. Output
+    follows completion order, not input order; every record carries its
+    report id.
+
+    Args:
+        reports: Report dicts as returned by load_reports.
+        output: Writable text file object.
+        summarize: Also generate the LLM triage summary for each report.
+        progress: Optional callback(done, total).
+
+    Returns:
+        Dict with counts of processed, located and unlocated reports, and of
+        records with failed enrichment lookups.
+    """
+    nominatim = RateLimiter(config.NOMINATIM_MIN_INTERVAL_S)
+    overpass = RateLimiter(config.OVERPASS_MIN_INTERVAL_S)
+    geocoded = {}  # normalized address -> (lat, lon, place, error)
+    places = {}  # rounded location -> place
+    cell_contexts = OrderedDict()  # LRU of fully successful cell lookups
+    cell_locks = {}  # cell -> lock, so a cell is only fetched by one worker at a time
+    cache_lock = threading.Lock()
+    model = detection.load_model()
+    detections = {}
+    detect_lock = threading.Lock()
+    total = len(reports)
+    stats = {"processed": 0, "located": 0, "unlocated": 0, "enrichment_errors": 0}
+
+    def location_key(lat, lon):
+        return (
+            round(lat, config.BATCH_LOCATION_DECIMALS),
+            round(lon, config.BATCH_LOCATION_DECIMALS),
+        )
+
+    def get_cell_context(cell):
+        with cache_lock:
+            cell_lock = cell_locks.setdefault(cell, threading.Lock())
+        with cell_lock:
+            with cache_lock:
+                cell_context = cell_contexts.get(cell)
+                if cell_context is not None:
+                    cell_contexts.move_to_end(cell)
+                    return cell_context
+            cell_context = fetch_cell_context(*cell, limiter=overpass)
+            if not cell_context["errors"]:
+                with cache_lock:
+                    cell_contexts[cell] = cell_context
+                    if len(cell_contexts) > config.BATCH_CELL_CACHE_SIZE:
+                        cell_contexts.popitem(last=False)
+            return cell_context
+
+    def process_cell(cell, group):
+        cell_context = get_cell_context(cell)
+        records = []
+        for report, lat, lon in group:
+            location = location_key(lat, lon)
+            with cache_lock:
+                place = places.get(location)
+            if place is None:
+                nominatim.wait()
+                place = _place(geo.reverse_geocode(lat, lon))
+                if "error" not in place:
+                    with cache_lock:
+                        places[location] = place
+            records.append(_triage_record(
+                report, lat, lon, place, cell_context,
+                model, detections, detect_lock, overpass, summarize,
+            ))
+        return records
+
+    def write(record):
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stats["processed"] += 1
+
+    pending = set()
+
+    def collect(block):
+        nonlocal pending
+        if not pending:
+            return
+        done, pending = wait(
+            pending, timeout=None if block else 0, return_when=FIRST_COMPLETED
+        )
+        for future in done:
+            for record in future.result():
+                if "errors" in record:
+                    stats["enrichment_errors"] += 1
+                write(record)
+                stats["located"] += 1
+        output.flush()
+        if progress:
+            progress(stats["processed"], total)
+
+    with ThreadPoolExecutor(max_workers=config.BATCH_WORKERS) as pool:
+        for start in range(0, total, config.BATCH_CHUNK_SIZE):
+            cells = {}
+            for report in reports[start:start + config.BATCH_CHUNK_SIZE]:
+                lat, lon = report["lat"], report["lon"]
+                if lat is None or lon is None:
+                    key = _normalize_address(report["address"])
+                    place = None
+                    if not key:
+                        error = ADDRESS_NOT_FOUND
+                    else:
+                        if key not in geocoded:
+                            geocoded[key] = geocode_address(report["address"], nominatim)
+                        lat, lon, place, error = geocoded[key]
+                    if lat is None or lon is None:
+                        write({**report, "error": error})
+                        stats["unlocated"] += 1
+                        continue
+                    with cache_lock:
+                        places.setdefault(location_key(lat, lon), place)
+                cells.setdefault(_cell_key(lat, lon), []).append((report, lat, lon))
+
+            for cell, group in cells.items():
+                pending.add(pool.submit(process_cell, cell, group))
+            collect(block=False)
+            # Bounds memory: geocoding only runs a few chunks ahead of the workers.
+            while len(pending) > config.BATCH_MAX_PENDING_CELLS:
+                collect(block=True)
+
+        while pending:
+            collect(block=True)
+
+    output.flush()
+    if progress:
+        progress(stats["processed"], total)
+    return stats
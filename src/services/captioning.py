@@ -1,15 +1,79 @@
 # services/captioning.py
+import torch
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import config
 
-def load_blip():
+HALF_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def _resolve_precision(precision, device):
+    """
+    Maps a precision setting to one that is usable on the given device.
+    fp16 and int8 are only honored where they run well (GPU/MPS and CPU respectively).
+    """
+    if precision == "auto":
+        return "fp16" if device != "cpu" else "fp32"
+    if precision == "fp16" and device == "cpu":
+        return "fp32"
+    if precision == "int8" and device != "cpu":
+        return "fp16"
+    return precision
+
+
+def load_blip(device=config.DEVICE, precision=config.BLIP_PRECISION):
     """
     Loads the BLIP captioning model and processor.
+
+    The model is placed on `device` in eval mode. `precision` is one of
+    "auto", "fp32", "fp16", "bf16" or "int8" (dynamic quantization, CPU only).
     """
     processor = BlipProcessor.from_pretrained(config.BLIP_MODEL_NAME)
     model = BlipForConditionalGeneration.from_pretrained(config.BLIP_MODEL_NAME)
+    precision = _resolve_precision(precision, device)
+
+    if precision == "int8":
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif precision in HALF_DTYPES:
+        model = model.to(dtype=HALF_DTYPES[precision])
+
+    model = model.to(device).eval()
     return processor, model
 
+
+def _caption_tags(caption):
+    tags = caption.lower().replace(".", "").split()
+    return list(dict.fromkeys(tags))[:10]
+
+
+def generate_captions(
+    processor,
+    model,
+    images,
+    batch_size=config.BLIP_BATCH_SIZE,
+    max_new_tokens=config.BLIP_MAX_NEW_TOKENS,
+):
+    """
+    Generates captions and tags for a list of images, `batch_size` at a time.
+
+    Returns:
+        List of (caption, top_tags) tuples, in the same order as `images`.
+    """
+    # Quantized models keep float32 activations; parameters give device and dtype.
+    param = next(model.parameters())
+    results = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        inputs = processor(images=batch, return_tensors="pt")
+        pixel_values = inputs["pixel_values"].to(param.device, dtype=param.dtype)
+        with torch.inference_mode():
+            out = model.generate(pixel_values=pixel_values, max_new_tokens=max_new_tokens)
+        for caption in processor.batch_decode(out, skip_special_tokens=True):
+            results.append((caption, _caption_tags(caption)))
+    return results
+
+
 def generate_caption(processor, model, image):
     """
     Generates a caption and a list of key tags from the image.
@@ -18,9 +82,4 @@ def generate_caption(processor, model, image):
         caption: Generated caption string.
         top_tags: List of up to 10 unique, lowercase tags derived from the caption.
     """
-    inputs = processor(images=image, return_tensors="pt")
-    out = model.generate(**inputs)
-    caption = processor.decode(out[0], skip_special_tokens=True)
-    tags = caption.lower().replace(".", "").split()
-    top_tags = list(dict.fromkeys(tags))[:10]
-    return caption, top_tags
+    return generate_captions(processor, model, [image])[0]
@@ -33,7 +33,10 @@ def detect_potholes(model, image):
     with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
         image.save(tmp.name)
         image_path = tmp.name
+    try:
         results = model(image_path)
+    finally:
+        os.remove(image_path)
 
     result = results[0]
     boxes = result.boxes
@@ -59,3 +62,12 @@ def detect_potholes(model, image):
         avg_area = 0
 
     return annotated_img, pothole_areas, avg_area, severity
+
+
+def detect_labels(model, image):
+    """
+    Runs detection and returns the unique class names found in the image.
+    """
+    result = model(image)[0]
+    labels = [result.names[int(cls)] for cls in result.boxes.cls.tolist()]
+    return list(dict.fromkeys(labels))
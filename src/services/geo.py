@@ -1,23 +1,55 @@
 # services/geo.py
+import math
 import requests
 import json
 import config
+from services import road_tiles
+
+EARTH_RADIUS_M = 6371000
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in meters between two coordinates.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def element_coords(element):
+    """
+    Returns (lat, lon) for an Overpass element, using its center for ways/relations.
+    """
+    lat = element.get("lat") or element.get("center", {}).get("lat")
+    lon = element.get("lon") or element.get("center", {}).get("lon")
+    return lat, lon
+
+def search_address(address):
+    """
+    Returns the best Nominatim match for an address, including address details
+    (road, city, ...), or None if nothing was found. Raises on request errors.
+    """
+    params = {
+        "q": address,
+        "format": "json",
+        "addressdetails": 1,
+        "limit": config.NOMINATIM_SEARCH_LIMIT,
+    }
+    headers = {"User-Agent": config.NOMINATIM_USER_AGENT}
+    response = requests.get(config.NOMINATIM_SEARCH_URL, params=params, headers=headers)
+    response.raise_for_status()
+    results = response.json()
+    return results[0] if results else None
 
 def forward_geocode(address):
     """
     Converts an address string into geographic coordinates using Nominatim.
     """
     try:
-        params = {
-            "q": address,
-            "format": "json",
-            "limit": config.NOMINATIM_SEARCH_LIMIT,
-        }
-        headers = {"User-Agent": config.NOMINATIM_USER_AGENT}
-        response = requests.get(config.NOMINATIM_SEARCH_URL, params=params, headers=headers)
-        results = response.json()
-        if results:
-            return float(results[0]["lat"]), float(results[0]["lon"]), results[0]["display_name"]
+        result = search_address(address)
+        if result:
+            return float(result["lat"]), float(result["lon"]), result["display_name"]
         else:
             return None, None, "Endereço não encontrado"
     except Exception as e:
@@ -38,6 +70,7 @@ def reverse_geocode(lat, lon):
 def query_all_amenities(lat, lon, radius=config.AMENITY_RADIUS):
     """
     Fetches all amenities around a location within the specified radius.
+    Returns {"error": ...} if the request fails or Overpass reports a remark.
     """
     query = f"""
         [out:json];
@@ -50,8 +83,11 @@ def query_all_amenities(lat, lon, radius=config.AMENITY_RADIUS):
     """
     try:
         response = requests.post(config.OVERPASS_API_URL, data={"data": query})
-        data = response.json().get("elements", [])
-        return data
+        data = response.json()
+        if data.get("remark"):
+            # Overpass reports timeouts/runtime errors here, with partial elements.
+            return {"error": data["remark"]}
+        return data.get("elements", [])
     except Exception as e:
         return {"error": str(e)}
 
@@ -107,39 +143,7 @@ def query_nearby_amenities(lat, lon, types, radius=config.AMENITY_RADIUS):
 
 def query_traffic_data(lat, lon, street_name=None):
     """
-    Queries nearby road data and attempts to match a street name.
-    """
-    query = f"""
-    [out:json];
-    way(around:{config.TRAFFIC_RADIUS},{lat},{lon})["highway"];
-    out body;
+    Returns the attributes of the nearest road, preferring one matching the street name.
+    Road segments come from the precomputed tile cache (services/road_tiles.py).
     """
-    try:
-        response = requests.post(config.OVERPASS_API_URL, data={"data": query})
-        elements = response.json().get("elements", [])
-        if not elements:
-            return {"error": "No roads found near this location"}
-        if street_name:
-            street_name = street_name.lower().strip()
-            for e in elements:
-                tags = e.get("tags", {})
-                name = tags.get("name", "").lower().strip()
-                if name == street_name:
-                    return {
-                        "matched": True,
-                        "street": name,
-                        "tags": tags,
-                        "raw": e
-                    }
-        for e in elements:
-            tags = e.get("tags", {})
-            if "maxspeed" in tags or "lanes" in tags or "surface" in tags:
-                return {
-                    "matched": False,
-                    "street": tags.get("name", "unknown"),
-                    "tags": tags,
-                    "raw": e
-                }
-        return {"error": "No traffic-relevant tags found"}
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+    return road_tiles.nearest_road(lat, lon, street_name=street_name)
@@ -2,8 +2,204 @@
 import json
 import re
 import time
+from functools import lru_cache
 import ollama
+from transformers import AutoTokenizer
 import config
+from services import geo
+
+# Fixed system prefix: identical on every call so Ollama can reuse its prompt cache.
+SUMMARY_SYSTEM_PROMPT = """You are a municipal AI agent that summarizes pothole triage cases for dispatchers and city planners.
+
+The user message is compact JSON describing one case. Generate a 3–5 sentence summary covering:
+- 📍 Location and road name
+- 🕳️ Severity and key visual tags
+- 🚦 Road type, speed, and rules
+- 🏥 Risk level based on proximity to hospitals, schools, etc.
+- 🧱 Contextual environment (e.g. presence of amenities)
+
+Answer a 100% BR Portuguese. Respond with only the summary. No title, no comments, no JSON."""
+
+
+@lru_cache(maxsize=1)
+def _tokenizer():
+    try:
+        return AutoTokenizer.from_pretrained(
+            config.LLM_TOKENIZER_NAME, local_files_only=True
+        )
+    except Exception as e:
+        print(
+            f"⚠️ Tokenizer not found at {config.LLM_TOKENIZER_NAME} ({e}); "
+            f"estimating prompt tokens as {config.LLM_CHARS_PER_TOKEN} chars/token"
+        )
+        return None
+
+
+def count_tokens(text):
+    """
+    Counts tokens with the local LLM tokenizer, or estimates them from
+    the character count when the tokenizer is not available.
+    """
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return len(text) // config.LLM_CHARS_PER_TOKEN + 1
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _nearest_facility(facility_flags, lat, lon):
+    nearest = None
+    nearest_distance = None
+    within = 0
+    for item in facility_flags:
+        for el in item.get("results", {}).get("elements", []):
+            f_lat, f_lon = geo.element_coords(el)
+            if f_lat is None or f_lon is None:
+                continue
+            distance = geo.haversine_m(lat, lon, f_lat, f_lon)
+            if distance < config.FACILITY_THRESHOLD_M:
+                within += 1
+            if nearest is None or distance < nearest_distance:
+                nearest_distance = distance
+                nearest = {
+                    "type": item.get("tag"),
+                    "name": el.get("tags", {}).get("name"),
+                    "distance_m": round(distance),
+                }
+    return nearest, within
+
+
+def _compact(value):
+    """
+    Recursively drops empty values so they cost no tokens.
+    """
+    if isinstance(value, dict):
+        compacted = {k: _compact(v) for k, v in value.items()}
+        return {k: v for k, v in compacted.items() if v not in (None, "", [], {})}
+    return value
+
+
+def build_summary_payload(
+    geo_info,
+    lat,
+    lon,
+    caption="",
+    tags=None,
+    severity=None,
+    traffic_data=None,
+    facility_flags=None,
+    organized_amenities=None,
+):
+    """
+    Reduces the raw pipeline outputs to the fields the summary actually uses:
+    a whitelist of traffic tags, counts per amenity type (most frequent first)
+    and the nearest critical facility.
+    """
+    traffic_tags = (traffic_data or {}).get("tags", {})
+    amenity_counts = sorted(
+        ((k, len(v)) for k, v in (organized_amenities or {}).items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    nearest, within = _nearest_facility(facility_flags or [], lat, lon)
+    address = geo_info.get("address", {})
+
+    return _compact({
+        "location": {
+            "address": geo_info.get("display_name"),
+            "lat": round(lat, 5),
+            "lon": round(lon, 5),
+            "city": address.get("city"),
+            "road": address.get("road"),
+        },
+        "severity": severity,
+        "caption": caption,
+        "tags": list(tags or []),
+        "traffic": {k: traffic_tags[k] for k in config.SUMMARY_TRAFFIC_TAGS if k in traffic_tags},
+        "amenity_counts": dict(amenity_counts[:config.SUMMARY_MAX_AMENITY_TYPES]),
+        "nearest_critical_facility": nearest,
+        "critical_facilities_within_threshold": within,
+    })
+
+
+def _shrink_amenities(payload):
+    counts = list(payload.get("amenity_counts", {}).items())
+    if not counts:
+        return False
+    kept = dict(counts[: len(counts) // 2])
+    if kept:
+        payload["amenity_counts"] = kept
+    else:
+        del payload["amenity_counts"]
+    return True
+
+
+def _shrink_tags(payload):
+    tags = payload.get("tags", [])
+    if len(tags) <= 3:
+        return False
+    payload["tags"] = tags[:3]
+    return True
+
+
+def _drop_address(payload):
+    return payload.get("location", {}).pop("address", None) is not None
+
+
+def _shrink_traffic(payload):
+    traffic = payload.get("traffic", {})
+    core = {k: v for k, v in traffic.items() if k in ("highway", "maxspeed", "lanes", "surface")}
+    if core == traffic:
+        return False
+    payload["traffic"] = core
+    return True
+
+
+def _truncate_caption(payload):
+    caption = payload.get("caption", "")
+    if len(caption) <= 80:
+        return False
+    payload["caption"] = caption[:80]
+    return True
+
+
+def _drop_field(key):
+    def drop(payload):
+        return payload.pop(key, None) is not None
+    return drop
+
+
+# Applied in order, each as often as it helps, until the payload fits the budget.
+# The last steps are hard cuts: only severity and facility risk survive them.
+PRUNE_STEPS = [
+    _shrink_amenities,
+    _shrink_tags,
+    _drop_address,
+    _shrink_traffic,
+    _truncate_caption,
+    _drop_field("caption"),
+    _drop_field("tags"),
+    _drop_field("traffic"),
+    _drop_field("location"),
+]
+
+
+def build_summary_prompt(payload, token_budget=config.SUMMARY_PROMPT_TOKEN_BUDGET):
+    """
+    Serializes the payload as compact JSON, pruning it until it fits the token budget.
+
+    Returns:
+        content: User message content.
+        tokens: Token count of the content.
+    """
+    payload = json.loads(json.dumps(payload))
+    content = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    tokens = count_tokens(content)
+    for step in PRUNE_STEPS:
+        while tokens > token_budget and step(payload):
+            content = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+            tokens = count_tokens(content)
+    return content, tokens
+
 
 def generate_triage_summary(
     geo_info,
@@ -29,45 +225,24 @@ def generate_triage_summary(
     # Assign default values if not provided.
     caption = caption if caption is not None else ""
     tags = tags if tags is not None else []
-    traffic_data = traffic_data if traffic_data is not None else {}
-    facility_flags = facility_flags if facility_flags is not None else {}
-    organized_amenities = organized_amenities if organized_amenities is not None else {}
-
-    summary_payload = {
-        "location": {
-            "display_name": geo_info.get("display_name"),
-            "coordinates": {"lat": lat, "lon": lon},
-            "city": geo_info.get("address", {}).get("city"),
-            "road": geo_info.get("address", {}).get("road"),
-        },
-        "caption": caption,
-        "tags": tags,
-        "severity": severity,
-        "traffic": traffic_data.get("tags", {}),
-        "facility_risk": {},  # Could be precomputed by a risk function if needed.
-        "amenity_types": list(organized_amenities.keys()),
-    }
-
-    prompt = f"""
-<|begin_of_text|>
-
-You are a municipal AI agent that summarizes pothole triage cases for dispatchers and city planners.
-
-Given the structured input below, generate a 3–5 sentence summary covering:
-- 📍 Location and road name
-- 🕳️ Severity and key visual tags
-- 🚦 Road type, speed, and rules
-- 🏥 Risk level based on proximity to hospitals, schools, etc.
-- 🧱 Contextual environment (e.g. presence of amenities)
 
-Use this structured data:
-```json
-{json.dumps(summary_payload, indent=2)}
-```
-
-Answer a 100% BR Portuguese. Respond with only the summary. No title, no comments, no JSON.
-<|eot_id|>
-"""
+    summary_payload = build_summary_payload(
+        geo_info,
+        lat,
+        lon,
+        caption=caption,
+        tags=tags,
+        severity=severity,
+        traffic_data=traffic_data,
+        facility_flags=facility_flags,
+        organized_amenities=organized_amenities,
+    )
+    content, tokens = build_summary_prompt(summary_payload)
+    if tokens > config.SUMMARY_PROMPT_TOKEN_BUDGET:
+        print(
+            f"⚠️ Triage summary prompt is {tokens} tokens after pruning "
+            f"(budget {config.SUMMARY_PROMPT_TOKEN_BUDGET})"
+        )
 
     attempt = 0
     last_exception = None
@@ -75,7 +250,11 @@ Answer a 100% BR Portuguese. Respond with only the summary. No title, no comment
         try:
             response = ollama.chat(
                 model=config.LLAMA_MODEL_DEFAULT,
-                messages=[{"role": "user", "content": prompt}],
+                messages=[
+                    {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                    {"role": "user", "content": content},
+                ],
+                keep_alive=config.LLM_KEEP_ALIVE,
             )
             return response["message"]["content"].strip()
         except Exception as e:
@@ -85,20 +264,7 @@ Answer a 100% BR Portuguese. Respond with only the summary. No title, no comment
     return f"(Triage Summary Error: {str(last_exception)})"
 
 
-def generate_llm_insight(image_path, caption=None, top_tags=None, retry_attempts=3):
-    """
-    Asks the LLM (with vision support) to produce image insights.
-    The caption and top_tags parameters are optional.
-    
-    If no caption is provided, an empty string is used.
-    If no top_tags are provided, an empty list is used.
-    
-    The prompt instructs the model to return a JSON object in the specified format.
-    """
-    caption = caption if caption is not None else ""
-    top_tags = top_tags if top_tags is not None else []
-    
-    prompt = f"""
+VISION_INSIGHT_PROMPT = """
 <|begin_of_text|><|image|>
 
 You are a visual scene tagging expert creating high-quality datasets for an AI pothole triage agent.
@@ -106,10 +272,10 @@ You are a visual scene tagging expert creating high-quality datasets for an AI p
 Your task is to return a valid JSON object in this format:
 
 ```json
-{{
+{
 "caption": "<short sentence (5–15 words)>",
 "tags": ["<tag1>", "<tag2>", "..."]
-}}
+}
 ```
 
 All tags must be:
@@ -120,30 +286,55 @@ All tags must be:
 
 ### 🔖 Example
 ```json
-{{
+{
 "caption": "large pothole on residential road with houses nearby",
 "tags": ["pothole", "patch", "asphalt", "house", "tree", "road", "sidewalk", "wall", "curb", "shadow"]
-}}
+}
 ```
 
 Now, analyze the uploaded image and return your response in the exact JSON format — no narration, no extra explanation.
 <|eot_id|>
 """
+
+
+def request_llm_insight(image_path, timeout=None):
+    """
+    Sends a single vision request to the LLM and parses its JSON answer.
+    Raises on transport errors, on `timeout` (seconds) or when no JSON object
+    is found in the output.
+    """
+    client = ollama.Client(timeout=timeout) if timeout else ollama
+    response = client.chat(
+        model=config.LLAMA_VISION_MODEL,
+        messages=[{"role": "user", "content": VISION_INSIGHT_PROMPT, "images": [image_path]}],
+        stream=False,  # Service layer waits for a complete response.
+    )
+    raw_response = response["message"]["content"]
+    json_match = re.search(r"\{.*\}", raw_response, re.DOTALL)
+    if json_match:
+        return json.loads(json_match.group(0))
+    else:
+        raise ValueError("No valid JSON found in model output")
+
+
+def generate_llm_insight(image_path, caption=None, top_tags=None, retry_attempts=3):
+    """
+    Asks the LLM (with vision support) to produce image insights.
+    The caption and top_tags parameters are optional.
+    
+    If no caption is provided, an empty string is used.
+    If no top_tags are provided, an empty list is used.
+    
+    The prompt instructs the model to return a JSON object in the specified format.
+    """
+    caption = caption if caption is not None else ""
+    top_tags = top_tags if top_tags is not None else []
+
     attempt = 0
     last_exception = None
     while attempt < retry_attempts:
         try:
-            response = ollama.chat(
-                model=config.LLAMA_VISION_MODEL,
-                messages=[{"role": "user", "content": prompt, "images": [image_path]}],
-                stream=False,  # Service layer waits for a complete response.
-            )
-            raw_response = response["message"]["content"]
-            json_match = re.search(r"\{.*\}", raw_response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group(0))
-            else:
-                raise ValueError("No valid JSON found in model output")
+            return request_llm_insight(image_path)
         except Exception as e:
             last_exception = e
             attempt += 1
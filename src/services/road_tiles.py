@@ -0,0 +1,257 @@
+# services/road_tiles.py
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+from functools import lru_cache
+
+import requests
+import config
+
+# Tile file layout (little-endian):
+#   header   : magic, bucket count, segment entry count, ways JSON length
+#   offsets  : bucket count + 1 entry offsets (bucket i -> entries[off[i]:off[i+1]])
+#   entries  : lat1, lon1, lat2, lon2, way index
+#   ways     : UTF-8 JSON list of {"id", "tags"}
+HEADER = struct.Struct("<4sIII")
+OFFSET = struct.Struct("<I")
+ENTRY = struct.Struct("<ddddI")
+MAGIC = b"RTC1"
+
+EARTH_RADIUS_M = 6371000
+EARTH_CIRCUMFERENCE_M = 2 * math.pi * 6378137
+TRAFFIC_KEYS = ("maxspeed", "lanes", "surface")
+NO_ROAD_FOUND = "No traffic-relevant tags found"  # A valid answer, not a lookup failure
+
+
+def tile_coords(lat, lon, zoom):
+    """
+    Fractional slippy-map coordinates of a point at the given zoom.
+    """
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def _tile_bbox(x, y, zoom):
+    """
+    Returns (south, west, north, east) of a slippy tile.
+    """
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def tile_path(x, y, zoom=config.ROAD_TILE_ZOOM):
+    return os.path.join(config.ROAD_TILE_CACHE_DIR, f"{zoom}_{x}_{y}.bin")
+
+
+def _fetch_ways(x, y, zoom):
+    south, west, north, east = _tile_bbox(x, y, zoom)
+    query = f"""
+    [out:json];
+    way["highway"]({south},{west},{north},{east});
+    out body geom;
+    """
+    response = requests.post(config.OVERPASS_API_URL, data={"data": query})
+    data = response.json()
+    if data.get("remark"):
+        # Overpass reports timeouts/runtime errors here; never cache a partial tile.
+        raise RuntimeError(data["remark"])
+    return data.get("elements", [])
+
+
+def build_tile(x, y, zoom=config.ROAD_TILE_ZOOM, bucket_bits=config.ROAD_TILE_BUCKET_BITS):
+    """
+    Downloads the highway ways of a tile and writes its cache file.
+
+    Every way is split into segments, and each segment is indexed under the
+    sub-tile buckets its bounding box touches.
+    """
+    side = 2 ** bucket_bits
+    cell_zoom = zoom + bucket_bits
+    buckets = [[] for _ in range(side * side)]
+    ways = []
+
+    for element in _fetch_ways(x, y, zoom):
+        geometry = element.get("geometry") or []
+        way_index = len(ways)
+        ways.append({"id": element.get("id"), "tags": element.get("tags", {})})
+        for a, b in zip(geometry, geometry[1:]):
+            ax, ay = tile_coords(a["lat"], a["lon"], cell_zoom)
+            bx, by = tile_coords(b["lat"], b["lon"], cell_zoom)
+            col_lo = max(int(math.floor(min(ax, bx))) - x * side, 0)
+            col_hi = min(int(math.floor(max(ax, bx))) - x * side, side - 1)
+            row_lo = max(int(math.floor(min(ay, by))) - y * side, 0)
+            row_hi = min(int(math.floor(max(ay, by))) - y * side, side - 1)
+            entry = ENTRY.pack(a["lat"], a["lon"], b["lat"], b["lon"], way_index)
+            for row in range(row_lo, row_hi + 1):
+                for col in range(col_lo, col_hi + 1):
+                    buckets[row * side + col].append(entry)
+
+    ways_blob = json.dumps(ways, ensure_ascii=False).encode("utf-8")
+    entry_count = sum(len(b) for b in buckets)
+
+    os.makedirs(config.ROAD_TILE_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=config.ROAD_TILE_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(buckets), entry_count, len(ways_blob)))
+        offset = 0
+        for bucket in buckets:
+            f.write(OFFSET.pack(offset))
+            offset += len(bucket)
+        f.write(OFFSET.pack(offset))
+        for bucket in buckets:
+            f.writelines(bucket)
+        f.write(ways_blob)
+    os.replace(tmp_path, tile_path(x, y, zoom))
+
+
+class RoadTile:
+    """
+    Read-only view over a memory-mapped tile cache file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, bucket_count, entry_count, ways_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Invalid road tile cache file: {path}")
+        self._offsets_at = HEADER.size
+        self._entries_at = self._offsets_at + OFFSET.size * (bucket_count + 1)
+        ways_at = self._entries_at + ENTRY.size * entry_count
+        self.ways = json.loads(self._mm[ways_at:ways_at + ways_len].decode("utf-8"))
+
+    def segments(self, bucket):
+        start, end = struct.unpack_from(
+            "<II", self._mm, self._offsets_at + OFFSET.size * bucket
+        )
+        for i in range(start, end):
+            yield ENTRY.unpack_from(self._mm, self._entries_at + ENTRY.size * i)
+
+
+def is_cached(x, y, zoom=config.ROAD_TILE_ZOOM):
+    return os.path.isfile(tile_path(x, y, zoom))
+
+
+@lru_cache(maxsize=config.ROAD_TILE_MEMORY_CACHE_SIZE)
+def load_tile(x, y, zoom=config.ROAD_TILE_ZOOM):
+    """
+    Returns the RoadTile for (x, y), downloading and building it on first use.
+    """
+    if not is_cached(x, y, zoom):
+        build_tile(x, y, zoom)
+    return RoadTile(tile_path(x, y, zoom))
+
+
+def _search_grid(lat, lon, radius):
+    """
+    Bucket grid around a point: bucket size in meters, the point's bucket
+    (col, row) and the number of rings a search within `radius` may scan.
+    """
+    cell_zoom = config.ROAD_TILE_ZOOM + config.ROAD_TILE_BUCKET_BITS
+    cell_m = EARTH_CIRCUMFERENCE_M * math.cos(math.radians(lat)) / 2 ** cell_zoom
+    fx, fy = tile_coords(lat, lon, cell_zoom)
+    return cell_m, int(fx), int(fy), int(radius // cell_m) + 2
+
+
+def tiles_around(lat, lon, radius=config.TRAFFIC_RADIUS):
+    """
+    Returns the (x, y) tiles nearest_road may read for a point, so callers
+    can build missing ones up front (e.g. under a rate limiter).
+    """
+    side = 2 ** config.ROAD_TILE_BUCKET_BITS
+    _, cx, cy, rings = _search_grid(lat, lon, radius)
+    reach = rings - 1
+    return [
+        (x, y)
+        for x in range((cx - reach) // side, (cx + reach) // side + 1)
+        for y in range((cy - reach) // side, (cy + reach) // side + 1)
+    ]
+
+
+def _segment_distance_m(lat, lon, lat1, lon1, lat2, lon2):
+    """
+    Distance in meters from a point to a segment, using a local
+    equirectangular projection centered on the point.
+    """
+    k_lat = math.radians(1) * EARTH_RADIUS_M
+    k_lon = k_lat * math.cos(math.radians(lat))
+    ax, ay = (lon1 - lon) * k_lon, (lat1 - lat) * k_lat
+    bx, by = (lon2 - lon) * k_lon, (lat2 - lat) * k_lat
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length_sq))
+    return math.hypot(ax + t * dx, ay + t * dy)
+
+
+def nearest_road(lat, lon, street_name=None, radius=config.TRAFFIC_RADIUS):
+    """
+    Finds the closest road segment to a point using the tile cache.
+
+    If street_name is given, the closest way with that name wins; otherwise
+    (or if none is in range) the closest way carrying maxspeed/lanes/surface.
+    Buckets are scanned in rings around the point and the search stops as
+    soon as no unscanned bucket can hold a closer segment.
+
+    Returns:
+        Dict with matched, street, distance_m, tags and raw way,
+        or {"error": ...} in the same shape as geo.query_traffic_data.
+    """
+    zoom = config.ROAD_TILE_ZOOM
+    side = 2 ** config.ROAD_TILE_BUCKET_BITS
+    cell_m, cx, cy, rings = _search_grid(lat, lon, radius)
+    wanted = street_name.lower().strip() if street_name else None
+
+    best_named = best_traffic = None
+    try:
+        for ring in range(rings):
+            bound = (ring - 1) * cell_m
+            target = best_named if wanted else best_traffic
+            if bound > radius or (target and bound > target[0]):
+                break
+            for col in range(cx - ring, cx + ring + 1):
+                for row in range(cy - ring, cy + ring + 1):
+                    if max(abs(col - cx), abs(row - cy)) != ring:
+                        continue
+                    tile = load_tile(col // side, row // side, zoom)
+                    bucket = (row % side) * side + (col % side)
+                    for lat1, lon1, lat2, lon2, way_index in tile.segments(bucket):
+                        distance = _segment_distance_m(lat, lon, lat1, lon1, lat2, lon2)
+                        if distance > radius:
+                            continue
+                        way = tile.ways[way_index]
+                        tags = way["tags"]
+                        if wanted and tags.get("name", "").lower().strip() == wanted:
+                            if best_named is None or distance < best_named[0]:
+                                best_named = (distance, way)
+                        if any(key in tags for key in TRAFFIC_KEYS):
+                            if best_traffic is None or distance < best_traffic[0]:
+                                best_traffic = (distance, way)
+    except Exception as e:
+        return {"error": str(e)}
+
+    if best_named:
+        distance, way = best_named
+        matched = True
+    elif best_traffic:
+        distance, way = best_traffic
+        matched = False
+    else:
+        return {"error": NO_ROAD_FOUND}
+
+    tags = way["tags"]
+    return {
+        "matched": matched,
+        "street": tags.get("name", "unknown").lower().strip() if matched else tags.get("name", "unknown"),
+        "distance_m": round(distance, 1),
+        "tags": tags,
+        "raw": {"type": "way", **way},
+    }
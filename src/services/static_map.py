@@ -0,0 +1,127 @@
+# services/static_map.py
+import io
+import math
+import os
+import tempfile
+
+import requests
+from PIL import Image, ImageColor, ImageDraw
+
+import config
+from services.road_tiles import tile_coords
+
+TILE_SIZE = 256
+
+
+def _tile_path(zoom, x, y):
+    return os.path.join(config.MAP_TILE_CACHE_DIR, str(zoom), str(x), f"{y}.png")
+
+
+def _rgb(color):
+    return ImageColor.getrgb(color)
+
+
+def load_map_tile(zoom, x, y, offline=config.MAP_TILES_OFFLINE):
+    """
+    Returns a base-map tile from the disk cache, downloading it first unless offline.
+    Returns None if the tile is neither cached nor downloadable.
+    """
+    path = _tile_path(zoom, x, y)
+    if os.path.isfile(path):
+        try:
+            return Image.open(path).convert("RGB")
+        except Exception:
+            # Corrupt cache entry: drop it so the tile can be fetched again.
+            os.remove(path)
+    if offline:
+        return None
+    try:
+        response = requests.get(
+            config.MAP_TILE_URL.format(z=zoom, x=x, y=y),
+            headers={"User-Agent": config.NOMINATIM_USER_AGENT},
+            timeout=10,
+        )
+        response.raise_for_status()
+        tile = Image.open(io.BytesIO(response.content)).convert("RGB")
+    except Exception:
+        return None
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp_path, path)
+    return tile
+
+
+def render_thumbnail(
+    lat,
+    lon,
+    facility_points,
+    radius=config.AMENITY_RADIUS,
+    zoom=config.FOLIUM_DEFAULT_ZOOM_START,
+    size=(config.FOLIUM_MAP_WIDTH, config.FOLIUM_MAP_HEIGHT),
+    offline=config.MAP_TILES_OFFLINE,
+):
+    """
+    Draws a static PNG of the pothole, its search radius and nearby facilities
+    over cached base-map tiles (missing tiles are left blank).
+
+    Args:
+        facility_points: Iterable of (lat, lon, label) tuples.
+
+    Returns:
+        png: PNG image bytes.
+        missing: Number of base-map tiles that could not be loaded.
+    """
+    width, height = size
+    cx, cy = (v * TILE_SIZE for v in tile_coords(lat, lon, zoom))
+    left, top = cx - width / 2, cy - height / 2
+
+    canvas = Image.new("RGB", size, "#f2f2f2")
+    missing = 0
+    for tx in range(int(left // TILE_SIZE), int((left + width) // TILE_SIZE) + 1):
+        for ty in range(int(top // TILE_SIZE), int((top + height) // TILE_SIZE) + 1):
+            tile = load_map_tile(zoom, tx, ty, offline=offline)
+            if tile is None:
+                missing += 1
+            else:
+                canvas.paste(tile, (round(tx * TILE_SIZE - left), round(ty * TILE_SIZE - top)))
+
+    def to_px(p_lat, p_lon):
+        px, py = tile_coords(p_lat, p_lon, zoom)
+        return px * TILE_SIZE - left, py * TILE_SIZE - top
+
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    meters_per_px = 156543.03392 * math.cos(math.radians(lat)) / 2 ** zoom
+    r = radius / meters_per_px
+    px, py = width / 2, height / 2
+    fill_alpha = round(255 * config.RADIUS_CIRCLE_FILL_OPACITY)
+    draw.ellipse(
+        (px - r, py - r, px + r, py + r),
+        fill=(*_rgb(config.RADIUS_CIRCLE_COLOR), fill_alpha),
+        outline=(*_rgb(config.RADIUS_CIRCLE_COLOR), 255),
+        width=2,
+    )
+
+    for f_lat, f_lon, _ in facility_points:
+        fx, fy = to_px(f_lat, f_lon)
+        draw.ellipse(
+            (fx - 5, fy - 5, fx + 5, fy + 5),
+            fill=(*_rgb(config.FACILITY_MARKER_COLOR), 230),
+            outline=(255, 255, 255, 255),
+        )
+
+    draw.ellipse(
+        (px - 7, py - 7, px + 7, py + 7),
+        fill=(*_rgb(config.POTHOLE_MARKER_COLOR), 255),
+        outline=(255, 255, 255, 255),
+        width=2,
+    )
+
+    canvas = Image.alpha_composite(canvas.convert("RGBA"), overlay)
+    buffer = io.BytesIO()
+    canvas.convert("RGB").save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue(), missing
@@ -0,0 +1,271 @@
+# services/vision.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import config
+from services import captioning, detection, llm
+
+_lock = threading.Lock()
+_expected_latency = dict(config.VISION_BACKEND_EXPECTED_LATENCY_S)
+_last_run = {}
+_probing = set()
+
+# Local models are loaded outside the timed path so that load time never
+# counts as inference latency.
+LOADERS = {
+    "blip": captioning.load_blip,
+    "yolo": detection.load_model,
+}
+_loader = ThreadPoolExecutor(max_workers=len(LOADERS))
+_models = {}
+_loading = {}  # name -> Future of the in-flight load
+
+
+def register_model(name, model):
+    """
+    Hands an already loaded model to a backend (e.g. the app's YOLO model).
+    """
+    with _lock:
+        _models[name] = model
+
+
+def _load(name):
+    try:
+        register_model(name, LOADERS[name]())
+    finally:
+        with _lock:
+            _loading.pop(name, None)
+
+
+def warm_up(backends=None):
+    """
+    Starts loading local backend models in the background. Safe to call on
+    every rerun; models already loaded or loading are skipped.
+    """
+    for name in backends or config.VISION_BACKENDS:
+        with _lock:
+            if name not in LOADERS or name in _models or name in _loading:
+                continue
+            _loading[name] = _loader.submit(_load, name)
+
+
+def _wait_loaded(name):
+    """
+    Blocks until a backend's model is loaded, joining an in-flight warm_up
+    load instead of starting a second one. Raises if the load fails.
+    """
+    warm_up([name])
+    with _lock:
+        future = _loading.get(name)
+    if future is not None:
+        future.result()
+
+
+def _ready(name):
+    with _lock:
+        return name not in LOADERS or name in _models
+
+
+def ollama_insight(image, image_path):
+    """
+    Caption and tags from the Ollama vision model (single attempt).
+    """
+    insight = llm.request_llm_insight(image_path, timeout=config.VISION_OLLAMA_TIMEOUT_S)
+    return {"caption": insight.get("caption", ""), "tags": insight.get("tags", [])}
+
+
+def blip_insight(image, image_path):
+    """
+    Caption and tags from the local BLIP captioning model.
+    """
+    processor, model = _models["blip"]
+    caption, tags = captioning.generate_caption(processor, model, image)
+    return {"caption": caption, "tags": tags}
+
+
+def yolo_insight(image, image_path):
+    """
+    Tags built from the YOLO class names only; the caption lists what was found.
+    """
+    labels = detection.detect_labels(_models["yolo"], image)
+    tags = ["road"]
+    for label in labels:
+        tags.extend(label.lower().split())
+    tags = list(dict.fromkeys(tags))[:10]
+    if labels:
+        caption = f"road surface with {', '.join(label.lower() for label in labels)}"
+    else:
+        caption = "road surface with no visible damage detected"
+    return {"caption": caption, "tags": tags}
+
+
+BACKENDS = {
+    "ollama": ollama_insight,
+    "blip": blip_insight,
+    "yolo": yolo_insight,
+}
+
+# One pool per backend, so calls stuck on a slow tier never queue the fast
+# ones. Timed-out calls cannot be cancelled; they finish in the background.
+_executors = {
+    name: ThreadPoolExecutor(max_workers=config.VISION_MAX_WORKERS) for name in BACKENDS
+}
+
+
+def expected_latency(name):
+    with _lock:
+        return _expected_latency[name]
+
+
+def _record_latency(name, seconds, reset=False):
+    """
+    Folds an observed latency into the backend's moving average, or replaces
+    it outright (`reset`) for a probe, the only fresh evidence for a skipped backend.
+    """
+    alpha = config.VISION_LATENCY_EWMA_ALPHA
+    with _lock:
+        if reset:
+            _expected_latency[name] = seconds
+        else:
+            _expected_latency[name] = (1 - alpha) * _expected_latency[name] + alpha * seconds
+
+
+def _record_timeout(name, seconds):
+    """
+    A timed-out call took at least `seconds`; never expect less than that.
+    """
+    with _lock:
+        _expected_latency[name] = max(_expected_latency[name], seconds)
+
+
+def _timed(name, image, image_path, probe=False, started_at=None):
+    """
+    Runs a backend and records its latency when it finishes, even if the
+    caller already gave up on it. The start time is also stored in the
+    `started_at` dict, so a caller can tell queue time from run time.
+    """
+    started = time.monotonic()
+    if started_at is not None:
+        started_at["at"] = started
+    with _lock:
+        _last_run[name] = started
+    try:
+        return BACKENDS[name](image, image_path)
+    finally:
+        _record_latency(name, time.monotonic() - started, reset=probe)
+        if probe:
+            with _lock:
+                _probing.discard(name)
+
+
+def _maybe_probe(name, image, image_path):
+    """
+    Sends a background canary request to a backend that keeps being skipped,
+    so its expected latency can come back down once it recovers.
+    """
+    with _lock:
+        if name in _probing:
+            return
+        if time.monotonic() - _last_run.get(name, 0.0) < config.VISION_PROBE_INTERVAL_S:
+            return
+        _probing.add(name)
+    _executors[name].submit(_timed, name, image, image_path, True)
+
+
+def _fallback_plan(candidates, remaining):
+    """
+    Picks the backend the router would fall back to next: the first later
+    candidate whose expected latency fits together with its own fallback
+    chain. Every backend down the chain thus keeps its expected latency.
+
+    Returns:
+        reserve: Seconds to hold back for the whole chain.
+        fallback: Name of the planned fallback, or None.
+    """
+    for index, name in enumerate(candidates):
+        reserve, _ = _fallback_plan(candidates[index + 1:], remaining)
+        needed = expected_latency(name) + reserve
+        if needed <= remaining:
+            return needed, name
+    return 0.0, None
+
+
+def generate_insight(image, image_path, budget_s=config.VISION_LATENCY_BUDGET_S, backends=None):
+    """
+    Produces {"caption", "tags"} for an image within a latency budget.
+
+    Backends are tried in preference order (richest first). Each attempt is
+    capped so the fallback chain after it still has its expected latencies
+    left in the budget; a backend that cannot fit, or whose model is still
+    loading, is skipped, and a timeout or error falls through to the next,
+    faster one. Expected latencies track observed ones, so a saturated LLM
+    tier is skipped automatically, and skipped backends are probed in the
+    background every VISION_PROBE_INTERVAL_S so they are used again once
+    they recover. If nothing fits, the fastest untried backend runs anyway.
+
+    Returns:
+        Dict with caption, tags, the backend used and its latency_s.
+    """
+    backends = backends or config.VISION_BACKENDS
+    warm_up(backends)
+    deadline = time.monotonic() + budget_s
+    tried = []
+    errors = {}
+    planned = None
+
+    for index, name in enumerate(backends):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if not _ready(name):
+            continue
+        later = [n for n in backends[index + 1:] if _ready(n)]
+        reserve, fallback = _fallback_plan(later, remaining)
+        allowed = remaining - reserve
+        # The planned fallback already had its time set aside; the overhead of
+        # the attempt before it must not push it out of the budget.
+        if name != planned and expected_latency(name) > allowed:
+            _maybe_probe(name, image, image_path)
+            continue
+
+        planned = fallback
+        tried.append(name)
+        started = time.monotonic()
+        started_at = {}
+        future = _executors[name].submit(_timed, name, image, image_path, False, started_at)
+        try:
+            insight = future.result(timeout=allowed)
+        except TimeoutError:
+            # Only time the call actually ran counts; a call still queued says
+            # nothing about the backend's own latency.
+            if "at" in started_at:
+                _record_timeout(name, time.monotonic() - started_at["at"])
+            errors[name] = f"timed out after {allowed:.1f}s"
+            continue
+        except Exception as e:
+            errors[name] = str(e)
+            continue
+
+        latency = time.monotonic() - started
+        return {**insight, "backend": name, "latency_s": round(latency, 2)}
+
+    untried = [name for name in backends if name not in tried]
+    if untried:
+        name = min(untried, key=expected_latency)
+        try:
+            if name in LOADERS and not _ready(name):
+                _wait_loaded(name)
+            started = time.monotonic()
+            insight = _timed(name, image, image_path)
+            latency = time.monotonic() - started
+            return {**insight, "backend": name, "latency_s": round(latency, 2)}
+        except Exception as e:
+            errors[name] = str(e)
+
+    return {
+        "caption": "",
+        "tags": [],
+        "backend": None,
+        "triage_notes": f"(Vision insight error – {errors})",
+    }